@@ -2,76 +2,243 @@ import re
 import time
 import json
 import base64
-from collections import Counter
-
+import asyncio
+import hashlib
+import functools
+import threading
+from collections import Counter, OrderedDict
+from html import escape as html_escape
+from itertools import chain
+
+import httpx
+import openai
 import streamlit as st
-
-# --- OpenAI client with backward compatibility (v1+ and legacy) ---
-class OpenAIClient:
-    def __init__(self, api_key: str):
-        self.use_modern = False
-        self.client = None
-        self.legacy = None
+import tiktoken
+from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+_DOMAIN = r'[a-zA-Z0-9][-a-zA-Z0-9]{0,62}\.[a-zA-Z0-9][-a-zA-Z0-9]{0,62}\.[a-zA-Z]{2,}|[a-zA-Z0-9][-a-zA-Z0-9]{0,62}\.[a-zA-Z]{2,}'
+_DOMAIN_RE = re.compile(r'(?:www\.)?(' + _DOMAIN + r')')
+# Either a full URL (capturing its host) or a bare domain, so one scan yields both
+_URL_OR_DOMAIN_RE = re.compile(
+    r'https?://(?:www\.)?(?P<host>(?:[-\w.]|(?:%[\da-fA-F]{2}))+)(?:/[-\w%!.?&=+]*)*'
+    r'|(?:www\.)?(?P<bare>' + _DOMAIN + r')'
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Maximum completion tokens per request for the selectable models
+_MAX_COMPLETION_TOKENS = {
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+    "gpt-4.1": 32768,
+    "gpt-3.5-turbo": 4096,
+}
+
+# Transient API failures (429s, dropped connections, timeouts) are retried with
+# jittered exponential backoff; anything else, or the last failed attempt, is re-raised.
+retry_api = retry(
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)),
+    reraise=True,
+)
+
+
+class ResponseCache:
+    """Bounded LRU of chat responses; entries expire ``ttl`` seconds after they are stored."""
+
+    def __init__(self, max_entries=500, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Streamlit runs each session's script in its own thread
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource(show_spinner=False)
+def response_cache():
+    """Chat responses shared across reruns, keyed by a SHA-256 of the request payload."""
+    return ResponseCache()
+
+
+class ApproxEncoding:
+    """Stand-in for a tiktoken encoding: roughly four characters per token."""
+
+    def encode(self, text):
+        return range(len(text) // 4 + 1)
+
+
+@functools.lru_cache(maxsize=8)
+def token_encoding(model):
+    # tiktoken downloads its BPE files on first use; the throttler only needs an
+    # estimate, so an unreachable download falls back instead of failing the run
+    try:
         try:
-            from openai import OpenAI  # v1+
-            self.client = OpenAI(api_key=api_key)
-            self.use_modern = True
-        except Exception:
-            import openai as legacy  # legacy
-            legacy.api_key = api_key
-            self.legacy = legacy
-
-    def chat(self, model: str, messages: list, max_tokens: int):
-        if self.use_modern:
-            return self.client.chat.completions.create(
-                model=model, messages=messages, max_tokens=max_tokens
-            ).choices[0].message.content
-        else:
-            # Legacy path
-            resp = self.legacy.ChatCompletion.create(
-                model=model, messages=messages, max_tokens=max_tokens
-            )
-            # robust extraction
-            choice = resp["choices"][0]
-            if isinstance(choice, dict):
-                return choice["message"]["content"]
-            return choice.message["content"]
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return ApproxEncoding()
+
+
+@st.cache_data(show_spinner=False)
+def parse_lines(text: str) -> list[str]:
+    """Non-empty, stripped lines of a text area."""
+    return [s.strip() for s in text.splitlines() if s.strip()]
+
+
+@st.cache_resource(show_spinner=False)
+def compile_brand_regex(brands: tuple):
+    """One-pass matcher for any brand, or None for an empty list."""
+    if not brands:
+        return None
+    # The zero-width lookahead reports the longest brand at every start position, so brands
+    # that overlap are all found; shorter brands nested at the same start ("Goldman" in
+    # "Goldman Sachs") are credited by ResourceAnalyzer.brands_in_match.
+    alternation = '|'.join(re.escape(b) for b in sorted(set(brands), key=len, reverse=True))
+    return re.compile(r'(?=\b(' + alternation + r')\b)', re.IGNORECASE)
+
+
+class RateLimiter:
+    """Request/token buckets that refill continuously up to the per-minute limits."""
+
+    def __init__(self, max_requests_per_minute, max_tokens_per_minute):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self.last_update = time.monotonic()
+        # Created on first acquire so it belongs to the event loop asyncio.run starts
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.available_request_capacity = min(
+            self.max_requests_per_minute,
+            self.available_request_capacity + self.max_requests_per_minute * elapsed / 60,
+        )
+        self.available_token_capacity = min(
+            self.max_tokens_per_minute,
+            self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60,
+        )
+        self.last_update = now
+
+    async def acquire(self, tokens):
+        # A single request can never need more than a full bucket
+        tokens = min(tokens, self.max_tokens_per_minute)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Holding the lock while waiting keeps callers in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available_request_capacity >= 1 and self.available_token_capacity >= tokens:
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= tokens
+                    return
+                wait = max(
+                    (1 - self.available_request_capacity) * 60 / self.max_requests_per_minute,
+                    (tokens - self.available_token_capacity) * 60 / self.max_tokens_per_minute,
+                )
+                await asyncio.sleep(max(wait, 0.01))
 
 
 # -----------------------------
 # Analyzer Class
 # -----------------------------
 class ResourceAnalyzer:
-    def __init__(self, api_key, model="gpt-4o", max_tokens=1000, system_prompt="", user_prompt="", brand_list=None):
-        self.client = OpenAIClient(api_key)
+    def __init__(self, api_key, model="gpt-4o", max_tokens=1000, system_prompt="", user_prompt="", brand_list=None, max_concurrency=10,
+                 max_requests_per_minute=500, max_tokens_per_minute=30000, use_cache=False):
+        # One pooled connection set for the analyzer's lifetime, sized to the concurrency cap,
+        # so concurrent requests reuse TLS connections instead of handshaking each time
+        self.aclient = AsyncOpenAI(
+            api_key=api_key,
+            # retry_api is the only retry layer, so the SDK's built-in retries are disabled
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+            ),
+        )
+        # Only a digest of the key goes into cache keys, never the key itself
+        self._api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        # Without use_cache every question is asked afresh; answers are still stored for later runs
+        self.use_cache = use_cache
         self.model = model
         self.max_tokens = max_tokens
         self.system_prompt = system_prompt
         self.user_prompt = user_prompt
         self.brand_list = brand_list if brand_list else []
+        # The system prompt is identical for every request, so tokenize it once
+        self._system_tokens = len(token_encoding(model).encode(system_prompt))
+        # One alternation finds every brand in a single pass over the text
+        self._brand_re = compile_brand_regex(tuple(self.brand_list))
+        self._brand_hits = {}
+        # Caps in-flight API calls so large question lists don't trip rate limits;
+        # created on first use so it belongs to the event loop asyncio.run starts
+        self.max_concurrency = max_concurrency
+        self._sem = None
+        self._limiter = RateLimiter(max_requests_per_minute, max_tokens_per_minute)
 
     def extract_urls(self, text):
-        url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?:/[-\w%!.?&=+]*)*'
-        domain_pattern = r'(?:www\.)?([a-zA-Z0-9][-a-zA-Z0-9]{0,62}\.[a-zA-Z0-9][-a-zA-Z0-9]{0,62}\.[a-zA-Z]{2,}|[a-zA-Z0-9][-a-zA-Z0-9]{0,62}\.[a-zA-Z]{2,})'
-
-        urls = re.findall(url_pattern, text or "")
-        domains = re.findall(domain_pattern, text or "")
-
+        if not text:
+            return {"full_urls": [], "domains": []}
+        urls = []
+        domains = []
         url_domains = []
-        for url in urls:
-            domain_match = re.search(r'https?://(?:www\.)?([^/]+)', url)
-            if domain_match:
-                url_domains.append(domain_match.group(1))
-
-        all_domains = list(set(domains + url_domains))
+        for m in _URL_OR_DOMAIN_RE.finditer(text):
+            if m.group("host"):
+                # A URL ending a sentence swallows the full stop; drop it so the
+                # host counts under the same key as the bare domain would
+                urls.append(m.group(0).rstrip("."))
+                url_domains.append(m.group("host").rstrip("."))
+                # Domains in the path or query string (e.g. redirect targets)
+                domains.extend(_DOMAIN_RE.findall(text, m.end("host"), m.end()))
+            else:
+                domains.append(m.group("bare"))
+
+        all_domains = list(dict.fromkeys(chain(domains, url_domains)))
         return {"full_urls": urls, "domains": all_domains}
 
     def extract_product_names(self, text):
-        product_mentions = []
-        for product in self.brand_list:
-            if re.search(r'\b' + re.escape(product) + r'\b', text or "", re.IGNORECASE):
-                product_mentions.append(product)
-        return product_mentions
+        if not text or self._brand_re is None:
+            return []
+        hits = set()
+        for matched in set(self._brand_re.findall(text)):
+            hits |= self.brands_in_match(matched)
+        # Each listed brand counts once per response, in the order it was submitted
+        return [b for i, b in enumerate(self.brand_list) if i in hits]
+
+    def brands_in_match(self, matched):
+        """Indices of the brands a matched name is, or contains as whole words."""
+        hits = self._brand_hits.get(matched)
+        if hits is None:
+            # Compared with the same IGNORECASE rules as the scan; str.lower() can disagree
+            hits = self._brand_hits[matched] = {
+                i for i, c in enumerate(self.brand_list)
+                if re.fullmatch(re.escape(c), matched, re.IGNORECASE)
+                or re.search(r'\b' + re.escape(c) + r'\b', matched, re.IGNORECASE)
+            }
+        return hits
 
     def analyze_response(self, response_text):
         return {
@@ -80,37 +247,146 @@ class ResourceAnalyzer:
             "response_length": len(response_text or ""),
         }
 
-    def get_response(self, question):
-        try:
-            user_msg = self.user_prompt.replace("{question}", question)
-            return self.client.chat(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_msg}
-                ],
-                max_tokens=self.max_tokens
+    def build_messages(self, question):
+        user_msg = self.user_prompt.replace("{question}", question)
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_msg}
+        ]
+
+    def build_batch_messages(self, questions):
+        numbered = "\n".join(
+            f"{i}. {self.user_prompt.replace('{question}', q)}" for i, q in enumerate(questions, 1)
+        )
+        user_msg = (
+            f"Answer each of the following {len(questions)} requests independently. "
+            'Reply with a JSON object of the form {"answers": ["...", "..."]} containing exactly '
+            "one answer string per request, in the same order.\n\n" + numbered
+        )
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_msg}
+        ]
+
+    def cache_key(self, messages, max_tokens=None):
+        payload = json.dumps({
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens or self.max_tokens,
+            "api_key_hash": self._api_key_hash,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def estimate_tokens(self, messages, max_tokens=None):
+        """Upper bound on the tokens a request consumes: prompt plus the completion budget."""
+        enc = token_encoding(self.model)
+        prompt_tokens = self._system_tokens + sum(
+            len(enc.encode(m["content"])) for m in messages if m["role"] != "system"
+        )
+        return prompt_tokens + (max_tokens or self.max_tokens)
+
+    @retry_api
+    async def _achat(self, messages, max_tokens=None, **kwargs):
+        max_tokens = max_tokens or self.max_tokens
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        async with self._sem:
+            await self._limiter.acquire(self.estimate_tokens(messages, max_tokens))
+            resp = await self.aclient.chat.completions.create(
+                model=self.model, messages=messages, max_tokens=max_tokens, **kwargs
             )
+        return resp.choices[0].message.content
+
+    async def aget_response(self, question):
+        messages = self.build_messages(question)
+        key = self.cache_key(messages)
+        cache = response_cache()
+        if self.use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        try:
+            resp = await self._achat(messages)
+            cache.set(key, resp)
+            return resp
         except Exception as e:
             st.error(f"Error calling OpenAI API: {e}")
-            time.sleep(2)
             return None
 
+    def max_batch_size(self):
+        """Largest batch whose combined completion budget fits the model's output cap."""
+        cap = _MAX_COMPLETION_TOKENS.get(self.model, 4096)
+        return max(1, cap // self.max_tokens)
+
+    async def aclose(self):
+        await self.aclient.close()
+
+    async def aget_batch_responses(self, questions):
+        """Answer several questions with one JSON-mode request, one answer per question.
+
+        Falls back to one request per question if the reply can't be mapped back.
+        """
+        if len(questions) == 1:
+            return [await self.aget_response(questions[0])]
+
+        messages = self.build_batch_messages(questions)
+        max_tokens = min(self.max_tokens * len(questions), _MAX_COMPLETION_TOKENS.get(self.model, 4096))
+        key = self.cache_key(messages, max_tokens)
+        cache = response_cache()
+        if self.use_cache:
+            answers = parse_batch_answers(cache.get(key), len(questions))
+            if answers is not None:
+                return answers
+        try:
+            content = await self._achat(messages, max_tokens, response_format={"type": "json_object"})
+            answers = parse_batch_answers(content, len(questions))
+            if answers is not None:
+                cache.set(key, content)
+                return answers
+        except Exception:
+            # Handled by the per-question fallback below, which reports its own failures
+            pass
+        return list(await asyncio.gather(*(self.aget_response(q) for q in questions)))
+
+
+def parse_batch_answers(content, n):
+    """Extract exactly ``n`` answers from a batched JSON reply, or None if it doesn't fit."""
+    try:
+        answers = json.loads(content)["answers"]
+    except (TypeError, ValueError, KeyError):
+        return None
+    if not isinstance(answers, list) or len(answers) != n:
+        return None
+    return [a if isinstance(a, str) else json.dumps(a) for a in answers]
+
+
+async def run_questions(analyzer, questions, progress, batch_size=1):
+    """Ask all questions concurrently, advancing the progress bar as each batch finishes."""
+    batch_size = min(batch_size, analyzer.max_batch_size())
+    batches = [questions[i:i + batch_size] for i in range(0, len(questions), batch_size)]
+    done = 0
+
+    async def track(batch):
+        nonlocal done
+        try:
+            resps = await analyzer.aget_batch_responses(batch)
+        except Exception as e:
+            resps = [e] * len(batch)
+        done += len(batch)
+        progress.progress(done / len(questions))
+        return resps
+
+    try:
+        batched = await asyncio.gather(*(track(b) for b in batches))
+    finally:
+        # The pooled connections belong to this event loop, which asyncio.run closes afterwards
+        await analyzer.aclose()
+    return [resp for resps in batched for resp in resps]
+
 
 # -----------------------------
 # HTML Export helpers
 # -----------------------------
-def html_escape(s: str) -> str:
-    """Escape text for safe HTML embedding."""
-    if s is None:
-        return ""
-    return (
-        s.replace("&", "&amp;")
-         .replace("<", "&lt;")
-         .replace(">", "&gt;")
-         .replace('"', "&quot;")
-    )
-
 def generate_html_report(*, results, mentions, brand_list, system_prompt, user_prompt, questions, model):
     """Self-contained HTML with working search + collapsible answers + prompts shown."""
     # Build brand mention list (keep original order submitted)
@@ -119,14 +395,15 @@ def generate_html_report(*, results, mentions, brand_list, system_prompt, user_p
         brand_items.append((brand, mentions["products"].get(brand, 0)))
 
     # Build the results section with <details>/<summary> and a robust search index
+    parts = []
     result_cards = []
     for r in results:
         q = r["question"] or ""
         a = r["response"] or ""
         safe_q = html_escape(q)
         safe_a = html_escape(a)
-        # Precompute a searchable, lowercased string in a data attribute (no quotes/newlines)
-        data_search = (q + " " + a).lower().replace("\n", " ").replace('"', "'")
+        # Precompute a searchable, lowercased string in a data attribute (no quotes, whitespace collapsed)
+        data_search = _WHITESPACE_RE.sub(" ", (q + " " + a).lower()).strip().replace('"', "'")
         card = f"""
         <details class="result" data-search="{html_escape(data_search)}">
             <summary class="question">Q: {safe_q}</summary>
@@ -136,7 +413,7 @@ def generate_html_report(*, results, mentions, brand_list, system_prompt, user_p
         result_cards.append(card)
 
     # Simple, robust search (filters by data-search attribute)
-    html = f"""<!DOCTYPE html>
+    parts.append(f"""<!DOCTYPE html>
 <html>
 <head>
 <meta charset="utf-8">
@@ -197,7 +474,7 @@ document.addEventListener('DOMContentLoaded', function() {{
     const cards = Array.from(document.querySelectorAll('.result'));
 
     function filter() {{
-        const q = (input.value || '').toLowerCase().trim();
+        const q = (input.value || '').toLowerCase().replace(/\\s+/g, ' ').trim();
         for (const el of cards) {{
             const hay = el.getAttribute('data-search');
             if (!q) {{
@@ -232,14 +509,18 @@ document.addEventListener('DOMContentLoaded', function() {{
     <div class="section panel">
         <h2>Questions asked</h2>
         <ol class="grid" style="margin-top:10px;">
-            {''.join(f'<li>{html_escape(q)}</li>' for q in questions)}
+            """)
+    parts.extend(f'<li>{html_escape(q)}</li>' for q in questions)
+    parts.append("""
         </ol>
     </div>
 
     <div class="section panel">
         <h2>Brand mentions</h2>
         <ul class="brand-list" style="margin-top:10px;">
-            {''.join(f'<li>{html_escape(b)} <span class="badge">{c}</span></li>' for b,c in brand_items)}
+            """)
+    parts.extend(f'<li>{html_escape(b)} <span class="badge">{c}</span></li>' for b,c in brand_items)
+    parts.append("""
         </ul>
     </div>
 
@@ -251,13 +532,15 @@ document.addEventListener('DOMContentLoaded', function() {{
     <div class="section">
         <h2>Responses</h2>
         <div class="grid" style="margin-top:10px;">
-            {''.join(result_cards)}
+            """)
+    parts.extend(result_cards)
+    parts.append("""
         </div>
     </div>
 
 </body>
-</html>"""
-    return html
+</html>""")
+    return "".join(parts)
 
 
 # -----------------------------
@@ -275,7 +558,7 @@ user_prompt = st.text_area("User Role Prompt (use {question} as placeholder)", "
 # Brand list
 st.subheader("🏢 Brand / Product List")
 brand_input = st.text_area("Enter brand names (one per line)", "BlackRock\nVanguard\nUBS\nFidelity\nGoldman Sachs")
-brand_list = [b.strip() for b in brand_input.splitlines() if b.strip()]
+brand_list = parse_lines(brand_input)
 
 # Questions
 st.subheader("❓ Questions to Ask")
@@ -283,13 +566,26 @@ questions_input = st.text_area("Enter questions (one per line)",
 """How do you evaluate the risk profile of corporate treasurers & cfos?
 How do you evaluate the risk profile of endowments & foundations?
 What are the key factors to consider when selecting institutional investors?""")
-questions = [q.strip() for q in questions_input.splitlines() if q.strip()]
+questions = parse_lines(questions_input)
 
 # Model + limit
-model = st.selectbox("Choose model", ["gpt-4o", "gpt-4o-mini", "gpt-4.1", "gpt-3.5-turbo"])
+m1, m2 = st.columns([3, 1])
+with m1:
+    model = st.selectbox("Choose model", ["gpt-4o", "gpt-4o-mini", "gpt-4.1", "gpt-3.5-turbo"])
+with m2:
+    max_concurrency = st.number_input("Max concurrent requests", min_value=1, max_value=64, value=10, step=1)
+r1, r2 = st.columns(2)
+with r1:
+    max_requests_per_minute = st.number_input("Max requests per minute", min_value=1, value=500, step=50)
+with r2:
+    max_tokens_per_minute = st.number_input("Max tokens per minute", min_value=1000, value=30000, step=1000)
 if len(questions) == 0:
     st.stop()
 limit = st.slider("Number of questions to analyze", 1, len(questions), min(5, len(questions)))
+batch_size = st.slider("Questions per request", 1, 10, 1,
+                       help="Values above 1 bundle questions into one JSON-mode request to save round-trips.")
+use_cache = st.checkbox("Use cached responses", value=False,
+                        help="Reuse answers to identical prompts from the last hour instead of asking the model again.")
 
 # Run
 if api_key and st.button("🚀 Run Analysis"):
@@ -298,15 +594,22 @@ if api_key and st.button("🚀 Run Analysis"):
         model=model,
         system_prompt=system_prompt,
         user_prompt=user_prompt,
-        brand_list=brand_list
+        brand_list=brand_list,
+        max_concurrency=int(max_concurrency),
+        max_requests_per_minute=int(max_requests_per_minute),
+        max_tokens_per_minute=int(max_tokens_per_minute),
+        use_cache=use_cache
     )
 
     results = []
     mentions = {"domains": Counter(), "products": Counter()}
 
     progress = st.progress(0)
-    for i, question in enumerate(questions[:limit]):
-        resp = analyzer.get_response(question)
+    responses = asyncio.run(run_questions(analyzer, questions[:limit], progress, batch_size))
+    for question, resp in zip(questions[:limit], responses):
+        if isinstance(resp, Exception):
+            st.error(f"Error analyzing question: {resp}")
+            continue
         if resp:
             analysis = analyzer.analyze_response(resp)
             results.append({
@@ -314,11 +617,8 @@ if api_key and st.button("🚀 Run Analysis"):
                 "response": resp,
                 "analysis": analysis
             })
-            for d in analysis["resources"]["domains"]:
-                mentions["domains"][d] += 1
-            for p in analysis["products"]:
-                mentions["products"][p] += 1
-        progress.progress((i+1)/limit)
+            mentions["domains"].update(analysis["resources"]["domains"])
+            mentions["products"].update(analysis["products"])
 
     # Summary
     st.subheader("📊 Top Mentioned Brands")
@@ -370,14 +670,17 @@ if api_key and st.button("🚀 Run Analysis"):
     st.subheader("👀 Preview Report")
     st.components.v1.html(html_report, height=650, scrolling=True)
 
+    # Encode once; the download and the data URL both reuse these bytes
+    report_bytes = html_report.encode("utf-8")
+
     # Open-in-new-tab link (data URL)
-    b64 = base64.b64encode(html_report.encode("utf-8")).decode("utf-8")
+    b64 = base64.b64encode(report_bytes).decode("ascii")
     st.markdown(f'<a href="data:text/html;base64,{b64}" target="_blank">Open full-size preview in a new tab</a>', unsafe_allow_html=True)
 
     # Download HTML
     st.download_button(
         label="⬇️ Download HTML Report",
-        data=html_report,
+        data=report_bytes,
         file_name="ai_visibility_report.html",
         mime="text/html"
     )